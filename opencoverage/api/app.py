@@ -2,6 +2,7 @@ from fastapi import APIRouter, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from opencoverage import taskrunner
+from opencoverage.clients.scm import close_session
 from opencoverage.database import Database
 from opencoverage.settings import Settings
 
@@ -36,3 +37,4 @@ class HTTPApplication(FastAPI):
     async def finalize(self) -> None:
         await self.taskrunner.stop_consuming()
         await self.db.finalize()
+        await close_session()
@@ -3,7 +3,7 @@ from typing import Optional
 from opencoverage.settings import Settings
 
 from . import github  # noqa
-from .base import SCMClient
+from .base import SCMClient, close_session, get_session  # noqa
 from .github import Github
 
 
@@ -1,21 +1,72 @@
 import abc
+import asyncio
 import traceback
 from typing import (
     AsyncIterator,
     List,
     Optional,
+    Tuple,
     Type,
 )
 
+import aiohttp
+
 from opencoverage.settings import Settings
 from opencoverage.types import Pull
 
+# max concurrent connections to a single scm host
+LIMIT_PER_HOST = 30
+
+# chunks a concurrent download may read ahead of its consumer
+DOWNLOAD_QUEUE_SIZE = 8
+_DOWNLOAD_DONE = object()
+
+# one session for the whole application so connections to the scm api
+# are kept alive and reused across clients
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=LIMIT_PER_HOST,
+                ttl_dns_cache=300,
+                keepalive_timeout=75,
+                enable_cleanup_closed=True,
+            ),
+            timeout=aiohttp.ClientTimeout(total=60, connect=10),
+            headers={"Accept-Encoding": "gzip"},
+        )
+    return _session
+
+
+async def close_session() -> None:
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
 
 class SCMClient(abc.ABC):
     installation_id: str
 
-    def __init__(self, settings: Settings, installation_id: Optional[str]):
+    def __init__(
+        self,
+        settings: Settings,
+        installation_id: Optional[str],
+        session: Optional[aiohttp.ClientSession] = None,
+    ):
         self.settings = settings
+        self._session = session
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._session = get_session()
+        return self._session
 
     async def close(self):  # pragma: no cover
         ...
@@ -32,6 +83,12 @@ class SCMClient(abc.ABC):
     ) -> str:  # pragma: no cover
         ...
 
+    @abc.abstractmethod
+    async def iter_pull_diff(
+        self, org: str, repo: str, id: int
+    ) -> AsyncIterator[str]:  # pragma: no cover
+        yield ""
+
     @abc.abstractmethod
     async def create_check(
         self, org: str, repo: str, commit: str
@@ -67,6 +124,58 @@ class SCMClient(abc.ABC):
     ) -> AsyncIterator[bytes]:  # pragma: no cover
         yield b""
 
+    async def download_files(
+        self,
+        org: str,
+        repo: str,
+        commit: str,
+        filenames: List[str],
+        concurrency: int = LIMIT_PER_HOST,
+    ) -> AsyncIterator[Tuple[str, AsyncIterator[bytes]]]:
+        """
+        Download files concurrently, yielding a stream per file in the order
+        of `filenames`.
+
+        A stream can only be read until the next file is requested; each
+        download buffers at most `DOWNLOAD_QUEUE_SIZE` chunks ahead of it.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _download(filename: str, queue: asyncio.Queue) -> None:
+            try:
+                async with semaphore:
+                    async for chunk in self.download_file(org, repo, commit, filename):
+                        await queue.put(chunk)
+            except Exception as exc:
+                await queue.put(exc)
+            else:
+                await queue.put(_DOWNLOAD_DONE)
+
+        async def _stream(queue: asyncio.Queue) -> AsyncIterator[bytes]:
+            while True:
+                item = await queue.get()
+                if item is _DOWNLOAD_DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+
+        queues: List[asyncio.Queue] = [
+            asyncio.Queue(DOWNLOAD_QUEUE_SIZE) for _ in filenames
+        ]
+        tasks = [
+            asyncio.ensure_future(_download(filename, queue))
+            for filename, queue in zip(filenames, queues)
+        ]
+        try:
+            for filename, queue, task in zip(filenames, queues, tasks):
+                yield filename, _stream(queue)
+                # drop what was not read so the connection is freed
+                task.cancel()
+        finally:
+            for task in tasks:
+                task.cancel()
+
     @abc.abstractmethod
     async def file_exists(
         self, org: str, repo: str, commit: str, filename: str
@@ -1,286 +1,302 @@
+import asyncio
+import codecs
+import functools
 import time
-from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from typing import (
     Any,
     AsyncIterator,
     Dict,
     List,
     Optional,
+    Tuple,
+    Type,
     cast,
 )
 
-import aiohttp_client
-import jwt
+import aiohttp
+import orjson
 import pydantic
-from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from jwt.algorithms import RSAAlgorithm
+from jwt.utils import base64url_encode
 
 from opencoverage.settings import Settings
 from opencoverage.types import Pull
+from opencoverage.utils import run_async
 
 from .base import SCMClient
 from .exceptions import APIException, AuthorizationException, NotFoundException
 
 
-class GithubUser(pydantic.BaseModel):
-    login: str
-    id: int
-    avatar_url: str
-    gravatar_id: str
-    url: str
-    type: str
-    site_admin: bool
-
-
-class GithubRepo(pydantic.BaseModel):
-    id: int
-    name: str
-    full_name: str
-    private: bool
-    owner: GithubUser
-    description: Optional[str]
-    fork: bool
-    url: str
-    created_at: str
-    updated_at: str
-
-
-class GithubRef(pydantic.BaseModel):
-    label: str
-    ref: str
-    sha: str
-    user: GithubUser
-    repo: GithubRepo
-
-
-class GithubPull(pydantic.BaseModel):
-    url: str
-    id: str
-    diff_url: str
-    patch_url: str
-    number: int
-    state: str
-    title: Optional[str]
-    user: GithubUser
-    created_at: str
-    updated_at: str
-    closed_at: Optional[str]
-    merged_at: Optional[str]
-    merge_commit_sha: str
-    assignee: Optional[GithubUser]
-    assignees: List[GithubUser]
-    requested_reviewers: List[GithubUser]
-    draft: bool
-    commits_url: str
-    head: GithubRef
-    base: GithubRef
-
-
-class GithubCheckOutput(pydantic.BaseModel):
-    title: Optional[str]
-    summary: Optional[str]
-    text: Optional[str]
-    annotations_count: int
-    annotations_url: Optional[str]
-
-
-class GithubApp(pydantic.BaseModel):
-    created_at: datetime
-    description: Optional[str]
-    external_url: str
-    id: int
-    name: str
-
-
-class GithubCheck(pydantic.BaseModel):
-    id: int
-    head_sha: str
-    node_id: Optional[str]
-    external_id: Optional[str]
-    url: Optional[str]
-    html_url: Optional[str]
-    details_url: Optional[str]
-    status: str
-    conclusion: Optional[str]
-    started_at: datetime
-    completed_at: Optional[datetime]
-    name: str
-
-    app: Optional[GithubApp]
-
-
-class GithubChecks(pydantic.BaseModel):
-    check_runs: List[GithubCheck]
-    total_count: int
-
-
 class GithubAccessData(pydantic.BaseModel):
+    # only what we use, the rest of the response is ignored
     token: str
     expires_at: datetime
-    permissions: Dict[str, str]
-    repository_selection: str
 
-
-class GithubComment(pydantic.BaseModel):
-    id: int
-    body: str
-    user: Optional[GithubUser]
+    class Config:
+        extra = "ignore"
 
 
 GITHUB_API_URL = "https://api.github.com"
+GITHUB_REPOS_URL = f"{GITHUB_API_URL}/repos"
+
+ACCEPT_JSON = "application/vnd.github.v3+json"
+ACCEPT_DIFF = "application/vnd.github.v3.diff"
+ACCEPT_RAW = "application/vnd.github.v3.raw"
+ACCEPT_GROOT = "application/vnd.github.groot-preview"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+_STATUS_EXCEPTIONS: Dict[int, Type[APIException]] = {
+    401: AuthorizationException,
+    404: NotFoundException,
+}
 
 
 class Token(pydantic.BaseModel):
     jwt_token: str
-    jwt_expiration: int
+    # expirations are tracked in event loop (monotonic) time
+    jwt_expiration: float
     access_data: Optional[GithubAccessData]
+    access_expiration: float = 0.0
 
 
 # this should
 _token_cache: Dict[str, Token] = {}
-_private_key_cache = {}
+_token_locks: Dict[str, asyncio.Lock] = {}
+
+PullsKey = Tuple[str, str, str]
+PULLS_CACHE_SIZE = 512
+PULLS_CACHE_TTL = 30
+# (org, repo, commit) -> (expiration in event loop time, pulls)
+_pulls_cache: "OrderedDict[PullsKey, Tuple[float, List[Pull]]]" = OrderedDict()
+# in flight requests so concurrent lookups of the same commit share one
+_pulls_requests: "Dict[PullsKey, asyncio.Future[List[Pull]]]" = {}
+
+JWT_EXPIRATION = 2 * 60
+# refresh tokens this long before they actually expire
+JWT_EXPIRATION_SKEW = 10
+ACCESS_TOKEN_EXPIRATION_SKEW = 30
+
+
+# the jwt header never changes so sign with a pre-resolved algorithm and
+# pre-encoded header instead of going through jwt.encode every time
+_jwt_algorithm = RSAAlgorithm(RSAAlgorithm.SHA256)
+_jwt_header = base64url_encode(orjson.dumps({"alg": "RS256", "typ": "JWT"}))
+
+
+def _encode_jwt(payload: Dict[str, Any], private_key: Any) -> str:
+    signing_input = b".".join((_jwt_header, base64url_encode(orjson.dumps(payload))))
+    signature = _jwt_algorithm.sign(signing_input, private_key)
+    return b".".join((signing_input, base64url_encode(signature))).decode("utf-8")
+
+
+@functools.lru_cache(maxsize=4)
+def _load_private_key(pem_file: str) -> Any:
+    with open(pem_file, "rb") as fi:
+        return serialization.load_pem_private_key(fi.read(), None)
+
+
+def _get_token_lock(installation_id: str) -> asyncio.Lock:
+    if installation_id not in _token_locks:
+        _token_locks[installation_id] = asyncio.Lock()
+    return _token_locks[installation_id]
 
 
 class Github(SCMClient):
-    def __init__(self, settings: Settings, installation_id: Optional[str]):
-        super().__init__(settings, installation_id)
+    def __init__(
+        self,
+        settings: Settings,
+        installation_id: Optional[str],
+        session: Optional[aiohttp.ClientSession] = None,
+    ):
+        super().__init__(settings, installation_id, session)
         self.installation_id = cast(
             str, installation_id or settings.github_default_installation_id
         )
         if settings.github_app_pem_file is None:
             raise TypeError("Must configure github_app_pem_file")
-        if settings.github_app_pem_file not in _private_key_cache:
-            with open(settings.github_app_pem_file, "rb") as fi:
-                _private_key_cache[
-                    settings.github_app_pem_file
-                ] = default_backend().load_pem_private_key(fi.read(), None)
-        self._private_key = _private_key_cache[settings.github_app_pem_file]
-
-    def _get_jwt_token(self) -> str:
-        time_since_epoch_in_seconds = int(time.time())
+        self._private_key = _load_private_key(settings.github_app_pem_file)
+
+    async def _get_jwt_token(self) -> str:
+        now = asyncio.get_running_loop().time()
         token_data = _token_cache.get(self.installation_id)
-        if token_data is None or token_data.jwt_expiration < (
-            time_since_epoch_in_seconds - 10
-        ):
-            jwt_expiration = time_since_epoch_in_seconds + (2 * 60)
+        if token_data is None or token_data.jwt_expiration <= now + JWT_EXPIRATION_SKEW:
+            time_since_epoch_in_seconds = int(time.time())
+            # rsa signing is cpu bound, keep it off the event loop
+            jwt_token = await run_async(
+                _encode_jwt,
+                {
+                    # issued at time
+                    "iat": time_since_epoch_in_seconds,
+                    # JWT expiration time (10 minute maximum)
+                    "exp": time_since_epoch_in_seconds + JWT_EXPIRATION,
+                    # GitHub App's identifier
+                    "iss": self.settings.github_app_id,
+                },
+                self._private_key,
+            )
             _token_cache[self.installation_id] = Token(
-                jwt_expiration=jwt_expiration,
-                jwt_token=jwt.encode(
-                    {
-                        # issued at time
-                        "iat": time_since_epoch_in_seconds,
-                        # JWT expiration time (10 minute maximum)
-                        "exp": jwt_expiration,
-                        # GitHub App's identifier
-                        "iss": self.settings.github_app_id,
-                    },
-                    self._private_key,
-                    algorithm="RS256",
-                ),
+                jwt_expiration=now + JWT_EXPIRATION, jwt_token=jwt_token
             )
         return _token_cache[self.installation_id].jwt_token
 
-    async def get_access_token(self) -> str:
+    def _get_cached_access_token(self) -> Optional[str]:
         token_data = _token_cache.get(self.installation_id)
+        if token_data is None or token_data.access_data is None:
+            return None
+        now = asyncio.get_running_loop().time()
+        if token_data.access_expiration <= now + ACCESS_TOKEN_EXPIRATION_SKEW:
+            return None
+        return token_data.access_data.token
+
+    async def get_access_token(self) -> str:
+        token = self._get_cached_access_token()
+        if token is not None:
+            return token
+
+        async with _get_token_lock(self.installation_id):
+            # another task may have refreshed the token while we were waiting
+            token = self._get_cached_access_token()
+            if token is not None:
+                return token
 
-        now = datetime.utcnow().replace(tzinfo=timezone.utc)
-        if (
-            token_data is None
-            or token_data.access_data is None
-            or token_data.access_data.expires_at < (now - timedelta(minutes=2))
-        ):
             url = (
                 f"{GITHUB_API_URL}/app/installations/{self.installation_id}/access_tokens"
             )
-            jwt_token = self._get_jwt_token()
-            async with aiohttp_client.post(
+            jwt_token = await self._get_jwt_token()
+            async with self.session.request(
+                "POST",
                 url,
-                headers={
-                    "Accepts": "application/vnd.github.v3+json",
-                    "Authorization": f"Bearer {jwt_token}",
-                },
+                headers={"Accept": ACCEPT_JSON, "Authorization": f"Bearer {jwt_token}"},
             ) as resp:
                 if resp.status != 201:
                     text = await resp.text()
                     raise APIException(
                         f"Could not authenticate with pem: {resp.status}: {text}"
                     )
-                data = await resp.json()
+                data = orjson.loads(await resp.read())
                 access_data = GithubAccessData.parse_obj(data)
-                _token_cache[self.installation_id].access_data = access_data
+                expires_in = access_data.expires_at - datetime.now(timezone.utc)
+                token_data = _token_cache[self.installation_id]
+                token_data.access_data = access_data
+                token_data.access_expiration = (
+                    asyncio.get_running_loop().time() + expires_in.total_seconds()
+                )
             return access_data.token
-        else:
-            return token_data.access_data.token
 
-    async def _prepare_request(
+    async def _auth_headers(self, accept: str = ACCEPT_JSON) -> Dict[str, str]:
+        token = await self.get_access_token()
+        return {"Accept": accept, "Authorization": f"token {token}"}
+
+    @asynccontextmanager
+    async def _request(
         self,
-        *,
-        url: str,
         method: str,
-        headers: Optional[Dict[str, str]] = None,
+        url: str,
+        *,
+        expect: Tuple[int, ...] = (200,),
+        error: str = "API error",
+        accept: str = ACCEPT_JSON,
         params: Optional[Dict[str, str]] = None,
         json: Optional[Dict[str, Any]] = None,
-    ):
-        func = getattr(aiohttp_client, method.lower())
-        headers = headers or {}
-        token = await self.get_access_token()
-        headers["Authorization"] = f"token {token}"
-        return func(url, headers=headers, params=params or {}, json=json)
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        headers = await self._auth_headers(accept)
+        data = None
+        if json is not None:
+            headers["Content-Type"] = "application/json"
+            data = orjson.dumps(json)
+        async with self.session.request(
+            method, url, headers=headers, params=params, data=data
+        ) as resp:
+            if resp.status not in expect:
+                text = await resp.text()
+                exc_type = _STATUS_EXCEPTIONS.get(resp.status, APIException)
+                raise exc_type(f"{error}: {resp.status}: {text}")
+            yield resp
+
+    async def _request_json(self, method: str, url: str, **kwargs) -> Any:
+        async with self._request(method, url, **kwargs) as resp:
+            return orjson.loads(await resp.read())
 
     async def validate(self) -> None:
         # getting a valid access token is all we need here
         await self.get_access_token()
 
     async def get_pulls(self, org: str, repo: str, commit_hash: str) -> List[Pull]:
-        url = f"{GITHUB_API_URL}/repos/{org}/{repo}/commits/{commit_hash}/pulls"
-        async with await self._prepare_request(
-            url=url,
-            method="get",
-            headers={"Accept": "application/vnd.github.groot-preview"},
+        key = (org, repo, commit_hash)
+        cached = _pulls_cache.get(key)
+        if cached is not None and cached[0] > asyncio.get_running_loop().time():
+            _pulls_cache.move_to_end(key)
+            return list(cached[1])
+
+        request = _pulls_requests.get(key)
+        if request is None:
+            request = asyncio.ensure_future(self._fetch_pulls(org, repo, commit_hash))
+            _pulls_requests[key] = request
+            request.add_done_callback(lambda _: _pulls_requests.pop(key, None))
+        return list(await asyncio.shield(request))
+
+    async def _fetch_pulls(self, org: str, repo: str, commit_hash: str) -> List[Pull]:
+        pulls = await self._get_pulls(org, repo, commit_hash)
+        key = (org, repo, commit_hash)
+        _pulls_cache[key] = (asyncio.get_running_loop().time() + PULLS_CACHE_TTL, pulls)
+        _pulls_cache.move_to_end(key)
+        if len(_pulls_cache) > PULLS_CACHE_SIZE:
+            _pulls_cache.popitem(last=False)
+        return pulls
+
+    async def _get_pulls(self, org: str, repo: str, commit_hash: str) -> List[Pull]:
+        url = f"{GITHUB_REPOS_URL}/{org}/{repo}/commits/{commit_hash}/pulls"
+        async with self._request(
+            "GET",
+            url,
+            # 422 means no pulls found
+            expect=(200, 422),
+            error="Error getting pulls",
+            accept=ACCEPT_GROOT,
         ) as resp:
             if resp.status == 422:
-                # no pulls found
                 return []
-            if resp.status == 401:
-                text = await resp.json()
-                raise AuthorizationException(f"API Unauthorized: {text}")
-
-            data = await resp.json()
-            pulls = []
-            for item in data:
-                gpull = GithubPull.parse_obj(item)
-                pulls.append(
-                    Pull(base=gpull.base.ref, head=gpull.head.ref, id=gpull.number)
-                )
-        return pulls
+            data = orjson.loads(await resp.read())
+        # only a few fields are needed, skip validating the full GithubPull
+        return [
+            Pull(base=item["base"]["ref"], head=item["head"]["ref"], id=item["number"])
+            for item in data
+        ]
 
     async def get_pull_diff(self, org: str, repo: str, id: int) -> str:
-        url = f"{GITHUB_API_URL}/repos/{org}/{repo}/pulls/{id}"
-        async with await self._prepare_request(
-            url=url,
-            method="get",
-            headers={"Accept": "application/vnd.github.v3.diff"},
+        return "".join([chunk async for chunk in self.iter_pull_diff(org, repo, id)])
+
+    async def iter_pull_diff(self, org: str, repo: str, id: int) -> AsyncIterator[str]:
+        url = f"{GITHUB_REPOS_URL}/{org}/{repo}/pulls/{id}"
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        async with self._request(
+            "GET",
+            url,
+            error="Error getting pull diff",
+            accept=ACCEPT_DIFF,
         ) as resp:
-            if resp.status == 401:
-                text = await resp.json()
-                raise AuthorizationException(f"API Unauthorized: {text}")
-            data = await resp.text()
-        return data
+            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                text = decoder.decode(chunk)
+                if text:
+                    yield text
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
 
     async def create_check(self, org: str, repo: str, commit: str) -> str:
-        url = f"{GITHUB_API_URL}/repos/{org}/{repo}/check-runs"
-        async with await self._prepare_request(
-            url=url,
-            method="post",
-            headers={"Accept": "application/vnd.github.v3+json"},
+        url = f"{GITHUB_REPOS_URL}/{org}/{repo}/check-runs"
+        data = await self._request_json(
+            "POST",
+            url,
+            expect=(201,),
+            error="Error creating check",
             json={"head_sha": commit, "name": "coverage", "status": "in_progress"},
-        ) as resp:
-            if resp.status != 201:
-                text = await resp.text()
-                raise AuthorizationException(
-                    f"Error creating check: {resp.status}: {text}"
-                )
-            check = GithubCheck.parse_obj(await resp.json())
-            return str(check.id)
+        )
+        return str(data["id"])
 
     async def update_check(
         self,
@@ -290,7 +306,7 @@ class Github(SCMClient):
         running: bool = False,
         success: bool = False,
     ) -> None:
-        url = f"{GITHUB_API_URL}/repos/{org}/{repo}/check-runs/{check_id}"
+        url = f"{GITHUB_REPOS_URL}/{org}/{repo}/check-runs/{check_id}"
         if success:
             conclusion = "success"
         else:
@@ -299,73 +315,58 @@ class Github(SCMClient):
             status = "in_progress"
         else:
             status = "completed"
-        async with await self._prepare_request(
-            url=url,
-            method="patch",
-            headers={"Accept": "application/vnd.github.v3+json"},
+        async with self._request(
+            "PATCH",
+            url,
+            error="Error updating check",
             json={"status": status, "conclusion": conclusion},
-        ) as resp:
-            if resp.status != 200:
-                text = await resp.text()
-                raise APIException(f"Error update check: {resp.status}: {text}")
+        ):
+            ...
 
     async def create_comment(self, org: str, repo: str, pull_id: int, text: str) -> str:
-        url = f"{GITHUB_API_URL}/repos/{org}/{repo}/issues/{pull_id}/comments"
-        async with await self._prepare_request(
-            url=url,
-            method="post",
-            headers={"Accept": "application/vnd.github.v3+json"},
+        url = f"{GITHUB_REPOS_URL}/{org}/{repo}/issues/{pull_id}/comments"
+        data = await self._request_json(
+            "POST",
+            url,
+            expect=(201,),
+            error="Error creating comment",
             json={"body": text},
-        ) as resp:
-            if resp.status != 201:
-                text = await resp.text()
-                raise APIException(f"Error update check: {resp.status}: {text}")
-            ob = GithubComment.parse_obj(await resp.json())
-            return str(ob.id)
+        )
+        return str(data["id"])
 
     async def update_comment(
         self, org: str, repo: str, comment_id: str, text: str
     ) -> None:
-        url = f"{GITHUB_API_URL}/repos/{org}/{repo}/issues/comments/{comment_id}"
-        async with await self._prepare_request(
-            url=url,
-            method="patch",
-            headers={"Accept": "application/vnd.github.v3+json"},
+        url = f"{GITHUB_REPOS_URL}/{org}/{repo}/issues/comments/{comment_id}"
+        async with self._request(
+            "PATCH",
+            url,
+            error="Error updating comment",
             json={"body": text},
-        ) as resp:
-            if resp.status != 200:
-                text = await resp.text()
-                raise APIException(f"Error update check: {resp.status}: {text}")
+        ):
+            ...
 
     async def file_exists(self, org: str, repo: str, commit: str, filename: str) -> bool:
-        url = f"{GITHUB_API_URL}/repos/{org}/{repo}/contents/{filename}"
-        async with await self._prepare_request(
-            url=url,
-            method="get",
+        url = f"{GITHUB_REPOS_URL}/{org}/{repo}/contents/{filename}"
+        async with self._request(
+            "GET",
+            url,
+            expect=(200, 404),
+            error="Error checking file",
             params={"ref": commit},
         ) as resp:
-            if resp.status == 401:
-                text = await resp.json()
-                raise AuthorizationException(f"API Unauthorized: {text}")
-            if resp.status == 404:
-                return False
-            return True
+            return resp.status != 404
 
     async def download_file(
         self, org: str, repo: str, commit: str, filename: str
     ) -> AsyncIterator[bytes]:
-        url = f"{GITHUB_API_URL}/repos/{org}/{repo}/contents/{filename}"
-        async with await self._prepare_request(
-            url=url,
-            method="get",
+        url = f"{GITHUB_REPOS_URL}/{org}/{repo}/contents/{filename}"
+        async with self._request(
+            "GET",
+            url,
+            error="Error downloading file",
             params={"ref": commit},
-            headers={"Accept": "application/vnd.github.v3.raw"},
+            accept=ACCEPT_RAW,
         ) as resp:
-            if resp.status == 401:
-                text = await resp.json()
-                raise AuthorizationException(f"API Unauthorized: {text}")
-            if resp.status == 404:
-                text = await resp.json()
-                raise NotFoundException(f"File not found: {text}")
-            while chunk := await resp.content.read(1024):
+            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
                 yield chunk
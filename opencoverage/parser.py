@@ -1,9 +1,9 @@
 import os
-from io import StringIO
-from typing import Dict, List
+import re
+import threading
+from typing import Dict, List, Optional
 
 from lxml import etree
-from unidiff import PatchSet
 
 from opencoverage import types
 
@@ -12,6 +12,17 @@ class ParsingException(Exception):
     ...
 
 
+# parser setup is not free so reuse one. Parsing runs in executor threads and
+# lxml serializes concurrent use of the same parser, so keep one per thread.
+_local = threading.local()
+
+
+def _get_xml_parser() -> etree.XMLParser:
+    if not hasattr(_local, "xml_parser"):
+        _local.xml_parser = etree.XMLParser(remove_blank_text=True, collect_ids=False)
+    return _local.xml_parser
+
+
 def get_el(el: etree.Element, name: str) -> etree.Element:
     rel = el.find(name)
     if rel is None:
@@ -47,7 +58,7 @@ def parse_raw_coverage_data(data: bytes) -> types.CoverageData:
 
     for filename, cov_data in coverage_files.items():
         try:
-            dom = etree.fromstring(cov_data)
+            dom = etree.fromstring(cov_data, _get_xml_parser())
         except etree.XMLSyntaxError:
             continue
 
@@ -95,24 +106,101 @@ def parse_raw_coverage_data(data: bytes) -> types.CoverageData:
         raise ParsingException("Could not find coverage file")
 
 
-def parse_diff(data: str) -> List[types.DiffCoverage]:
-    patch_set = PatchSet(StringIO(data))
-
-    diff_datas = []
-    for pfile in patch_set:
-        if pfile.is_binary_file or pfile.is_removed_file:
-            continue
-        lines = []
-        for chunk in pfile:
-            for line in chunk.target_lines():
-                if line.is_added:
-                    # only care about added lines
-                    lines.append(line.target_line_no)
-        if len(lines) > 0:
-            diff_datas.append(
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def _get_target_path(value: str) -> Optional[str]:
+    # strip optional timestamp
+    path = value.split("\t", 1)[0]
+    if path == "/dev/null":
+        # removed file
+        return None
+    if path.startswith("b/"):
+        path = path[2:]
+    return path
+
+
+class DiffParser:
+    """
+    Incrementally scan a unified diff for the lines each file adds so a diff
+    can be parsed while it is still being downloaded.
+
+    Only file headers and hunks are interpreted; binary, renamed and removed
+    files never produce added lines so they are skipped.
+    """
+
+    def __init__(self):
+        self.diff_datas: List[types.DiffCoverage] = []
+        self._buffer = ""
+        self._filename: Optional[str] = None
+        self._lines: List[int] = []
+        self._source_remaining = 0
+        self._target_remaining = 0
+        self._target_line_no = 0
+
+    def feed(self, data: str) -> None:
+        lines = (self._buffer + data).split("\n")
+        # last line may be incomplete, wait for the rest of it
+        self._buffer = lines.pop()
+        self._parse_lines(lines)
+
+    def finish(self) -> List[types.DiffCoverage]:
+        if self._buffer:
+            self._parse_lines([self._buffer])
+            self._buffer = ""
+        self._add_file(self._filename, self._lines)
+        self._filename = None
+        self._lines = []
+        return self.diff_datas
+
+    def _add_file(self, filename: Optional[str], lines: List[int]) -> None:
+        if filename is not None and len(lines) > 0:
+            self.diff_datas.append(
                 types.DiffCoverage(
-                    filename=pfile.path, lines=lines, line_rate=0.0, hits=0, misses=0
+                    filename=filename, lines=lines, line_rate=0.0, hits=0, misses=0
                 )
             )
 
-    return diff_datas
+    def _parse_lines(self, lines: List[str]) -> None:
+        # work with locals in the loop, it runs for every line of the diff
+        filename = self._filename
+        added = self._lines
+        source_remaining = self._source_remaining
+        target_remaining = self._target_remaining
+        target_line_no = self._target_line_no
+        for line in lines:
+            if source_remaining > 0 or target_remaining > 0:
+                marker = line[:1]
+                if marker == "+":
+                    # only care about added lines
+                    added.append(target_line_no)
+                    target_line_no += 1
+                    target_remaining -= 1
+                elif marker == "-":
+                    source_remaining -= 1
+                elif marker != "\\":
+                    # context line
+                    target_line_no += 1
+                    source_remaining -= 1
+                    target_remaining -= 1
+            elif line.startswith("+++ "):
+                self._add_file(filename, added)
+                filename = _get_target_path(line[4:])
+                added = []
+            elif line.startswith("@@ "):
+                match = _HUNK_HEADER.match(line)
+                if match is not None:
+                    source_remaining = int(match.group(2) or 1)
+                    target_line_no = int(match.group(3))
+                    target_remaining = int(match.group(4) or 1)
+        self._filename = filename
+        self._lines = added
+        self._source_remaining = source_remaining
+        self._target_remaining = target_remaining
+        self._target_line_no = target_line_no
+
+
+def parse_diff(data: str) -> List[types.DiffCoverage]:
+    diff_parser = DiffParser()
+    diff_parser.feed(data)
+    return diff_parser.finish()
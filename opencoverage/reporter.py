@@ -5,7 +5,7 @@ from opencoverage.settings import Settings
 from . import types
 from .clients import SCMClient
 from .database import Database
-from .parser import parse_diff, parse_raw_coverage_data
+from .parser import DiffParser, parse_raw_coverage_data
 from .utils import run_async
 
 
@@ -43,7 +43,6 @@ class CoverageReporter:
             commit_hash=self.commit,
             coverage=coverage,
         )
-
         pulls = await self.scm.get_pulls(self.organization, self.repo, self.commit)
         for pull in pulls:
             await self.update_pull(pull, coverage)
@@ -117,13 +116,17 @@ Diff coverage report: {self.settings.public_url}/{self.organization}/repos/{self
             return covered_diff_data, covered / total
         return covered_diff_data, 1.0
 
-    async def update_pull(self, pull: types.Pull, coverage: types.CoverageData):
-        diff = await self.scm.get_pull_diff(self.organization, self.repo, pull.id)
-        diff_data = await run_async(parse_diff, diff)
-        diff_data, diff_line_rate = self.get_line_rate(diff_data, coverage)
-
-        check_id = await self.scm.create_check(self.organization, self.repo, self.commit)
+    async def get_diff_data(self, pull: types.Pull) -> List[types.DiffCoverage]:
+        # parse the diff as it is downloaded
+        diff_parser = DiffParser()
+        async for chunk in self.scm.iter_pull_diff(self.organization, self.repo, pull.id):
+            diff_parser.feed(chunk)
+        return diff_parser.finish()
 
+    async def update_pull(self, pull: types.Pull, coverage: types.CoverageData):
+        # db calls are not run alongside scm calls: a failing scm call would
+        # leave them running on the connection of the caller's transaction
+        diff_data = await self.get_diff_data(pull)
         coverage_diff = await self.db.get_coverage_diff(
             organization=self.organization,
             repo=self.repo,
@@ -131,6 +134,11 @@ Diff coverage report: {self.settings.public_url}/{self.organization}/repos/{self
             commit_hash=self.commit,
             pull=pull,
         )
+        # only create the check once the diff is available so a failed
+        # download does not leave it in progress
+        check_id = await self.scm.create_check(self.organization, self.repo, self.commit)
+        diff_data, diff_line_rate = self.get_line_rate(diff_data, coverage)
+
         text = await self.get_coverage_comment(diff_data, coverage, diff_line_rate, pull)
 
         if coverage_diff is None:
@@ -16,7 +16,12 @@ class Element:
         ...
 
 
-def fromstring(text) -> Element:
+class XMLParser:
+    def __init__(self, **kwargs) -> None:
+        ...
+
+
+def fromstring(text, parser: Optional[XMLParser] = None) -> Element:
     ...
 
 
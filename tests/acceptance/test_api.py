@@ -1,9 +1,9 @@
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 import pytest
 
 from opencoverage import types
-from tests.utils import add_coverage, read_data
+from tests.utils import add_coverage, async_iter, read_data
 
 pytestmark = pytest.mark.asyncio
 
@@ -34,7 +34,7 @@ async def test_upload(http_client, scm):
 
 async def test_upload_against_pr(http_client, scm, tasks):
     scm.get_pulls.return_value = [types.Pull(head="test-changes", base="master", id="1")]
-    scm.get_pull_diff.return_value = """diff --git a/guillotina/addons.py b/guillotina/addons.py
+    diff = """diff --git a/guillotina/addons.py b/guillotina/addons.py
 index 8ad9304b..de0e1d25 100644
 --- a/guillotina/addons.py
 +++ b/guillotina/addons.py
@@ -47,6 +47,7 @@ index 8ad9304b..de0e1d25 100644
      config["enabled"] |= {addon}
 
 """
+    scm.iter_pull_diff = Mock(return_value=async_iter([diff]))
     scm.create_check.return_value = "check"
     scm.create_comment.return_value = "comment"
 
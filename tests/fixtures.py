@@ -1,9 +1,9 @@
 import os
 from unittest.mock import AsyncMock
 
-import aiohttp_client
 import pytest
 
+from opencoverage.clients.scm import close_session
 from opencoverage.settings import Settings
 
 
@@ -31,5 +31,5 @@ def settings(pg_dsn):
 
 
 @pytest.fixture(autouse=True)
-def clear_aiohttp_sessions(event_loop):
-    event_loop.run_until_complete(aiohttp_client.close())
+def clear_scm_session(event_loop):
+    event_loop.run_until_complete(close_session())
@@ -1,5 +1,3 @@
-from unittest.mock import Mock, patch
-
 import pytest
 from lxml import etree
 
@@ -161,14 +159,71 @@ index 8ad9304b..de0e1d25 100644
 
 
 def test_parse_diff_ignore_binary():
-    bpatch = Mock()
-    bpatch.is_binary_file = True
-    dpatch = Mock()
-    dpatch.is_binary_file = False
-    dpatch.is_removed_file = True
-    with patch("opencoverage.parser.PatchSet", return_value=[bpatch, dpatch]):
-        diff = parser.parse_diff("diff")
-        assert len(diff) == 0
+    diff = parser.parse_diff(
+        """diff --git a/image.png b/image.png
+index 8ad9304b..de0e1d25 100644
+Binary files a/image.png and b/image.png differ
+diff --git a/guillotina/addons.py b/guillotina/addons.py
+deleted file mode 100644
+index 8ad9304b..00000000
+--- a/guillotina/addons.py
++++ /dev/null
+@@ -1,2 +0,0 @@
+-import foo
+-import bar
+"""
+    )
+    assert len(diff) == 0
+
+
+def test_parse_diff_multiple_files_and_hunks():
+    diff = parser.parse_diff(
+        """diff --git a/foo.py b/foo.py
+index 8ad9304b..de0e1d25 100644
+--- a/foo.py
++++ b/foo.py
+@@ -1,3 +1,4 @@
+ one
++++two
+ three
+-four
++five
+@@ -10,2 +11,3 @@ def foo():
+ ten
++eleven
+ twelve
+\\ No newline at end of file
+diff --git a/bar.py b/bar.py
+new file mode 100644
+index 00000000..de0e1d25
+--- /dev/null
++++ b/bar.py
+@@ -0,0 +1 @@
++bar
+"""
+    )
+    assert [(d["filename"], d["lines"]) for d in diff] == [
+        ("foo.py", [2, 4, 12]),
+        ("bar.py", [1]),
+    ]
+
+
+def test_diff_parser_chunks():
+    data = """diff --git a/foo.py b/foo.py
+index 8ad9304b..de0e1d25 100644
+--- a/foo.py
++++ b/foo.py
+@@ -1,2 +1,3 @@
+ one
++two
+ three
+"""
+    diff_parser = parser.DiffParser()
+    # split in the middle of file headers and hunk lines
+    for chunk in (data[:60], data[60:95], data[95:]):
+        diff_parser.feed(chunk)
+    diff = diff_parser.finish()
+    assert [(d["filename"], d["lines"]) for d in diff] == [("foo.py", [2])]
 
 
 def test_parse_files():
@@ -1,9 +1,12 @@
-from unittest.mock import ANY, AsyncMock
+import asyncio
+from unittest.mock import ANY, AsyncMock, Mock
 
 import pytest
 
 from opencoverage import types
+from opencoverage.clients.scm.exceptions import APIException
 from opencoverage.reporter import CoverageReporter
+from tests import utils
 
 pytestmark = pytest.mark.asyncio
 
@@ -113,7 +116,7 @@ async def test_report_get_line_rate(reporter, db, scm):
 
 
 async def test_report_update_pull(reporter, db, scm):
-    scm.get_pull_diff.return_value = """diff --git a/guillotina/addons.py b/guillotina/addons.py
+    diff = """diff --git a/guillotina/addons.py b/guillotina/addons.py
 index 8ad9304b..de0e1d25 100644
 --- a/guillotina/addons.py
 +++ b/guillotina/addons.py
@@ -126,6 +129,7 @@ index 8ad9304b..de0e1d25 100644
      config["enabled"] |= {addon}
 
 """
+    scm.iter_pull_diff = Mock(return_value=utils.async_iter([diff]))
     coverage = {
         "base_path": None,
         "version": "5.3.1",
@@ -148,3 +152,34 @@ index 8ad9304b..de0e1d25 100644
     scm.update_check.assert_called_with(
         "organization", "repo", ANY, running=False, success=True
     )
+
+
+async def test_report_update_pull_diff_error(reporter, db, scm):
+    async def iter_pull_diff(*args):
+        raise APIException("Could not download diff")
+        yield b""
+
+    scm.iter_pull_diff = Mock(side_effect=iter_pull_diff)
+    with pytest.raises(APIException):
+        await reporter.update_pull(
+            types.Pull(id=1, base="base", head="head"),
+            {"file_coverage": {}},
+        )
+    scm.create_check.assert_not_called()
+    scm.update_check.assert_not_called()
+    db.get_coverage_diff.assert_not_called()
+
+
+async def test_report_get_pulls_error(reporter, db, scm):
+    saved = asyncio.Event()
+
+    async def save_coverage(**kwargs):
+        await asyncio.sleep(0.01)
+        saved.set()
+
+    db.save_coverage.side_effect = save_coverage
+    scm.get_pulls.side_effect = APIException("Could not get pulls")
+    with pytest.raises(APIException):
+        await reporter(coverage_data=utils.read_data("guillotina.cov"))
+    # no db write is left running once the reporter raises
+    assert saved.is_set()
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from datetime import datetime, timedelta, timezone
 from unittest.mock import (
@@ -7,6 +8,8 @@ from unittest.mock import (
     patch,
 )
 
+import jwt
+import orjson
 import pytest
 
 from opencoverage.clients import scm
@@ -18,7 +21,10 @@ pytestmark = pytest.mark.asyncio
 @pytest.fixture(autouse=True)
 def _clear():
     scm.github._token_cache.clear()
-    scm.github._private_key_cache.clear()
+    scm.github._token_locks.clear()
+    scm.github._pulls_cache.clear()
+    scm.github._pulls_requests.clear()
+    scm.github._load_private_key.cache_clear()
 
 
 def test_get_client_unsupported():
@@ -28,6 +34,13 @@ def test_get_client_unsupported():
         scm.get_client(settings, None)
 
 
+async def test_get_session_shared():
+    session = scm.get_session()
+    assert scm.get_session() is session
+    await scm.close_session()
+    assert scm.get_session() is not session
+
+
 class TestGithub:
     @pytest.fixture()
     async def client(self, settings):
@@ -40,10 +53,22 @@ class TestGithub:
     def response(self):
         res = AsyncMock()
         res.status = 200
-        res.json.return_value = {"foo": "bar"}
+        res.read.return_value = b'{"foo": "bar"}'
         res.text.return_value = '{"foo": "bar"}'
         yield res
 
+    @pytest.fixture()
+    def chunks(self, response):
+        chunks = [b"foo", b"bar"]
+
+        async def iter_chunked(size):
+            for chunk in chunks:
+                yield chunk
+
+        response.content = Mock()
+        response.content.iter_chunked = iter_chunked
+        yield chunks
+
     @pytest.fixture()
     def req(self, response):
         req = AsyncMock()
@@ -54,12 +79,9 @@ class TestGithub:
     def session(self, client, req):
         session = MagicMock()
 
-        session.post.return_value = req
-        session.patch.return_value = req
-        session.put.return_value = req
-        session.get.return_value = req
+        session.request.return_value = req
 
-        with patch("opencoverage.clients.scm.github.aiohttp_client", session):
+        with patch.object(client, "_session", session):
             yield session
 
     @pytest.fixture()
@@ -79,48 +101,118 @@ class TestGithub:
 
     async def test_get_access_token(self, client, session, response):
         response.status = 201
-        response.json.return_value = scm.github.GithubAccessData(
-            token="token",
-            expires_at=datetime.utcnow().replace(tzinfo=timezone.utc)
-            + timedelta(hours=1),
-            permissions={},
-            repository_selection="repository_selection",
-        ).dict()
+        response.read.return_value = orjson.dumps(
+            {
+                "token": "token",
+                "expires_at": (
+                    datetime.now(timezone.utc) + timedelta(hours=1)
+                ).isoformat(),
+                "permissions": {"checks": "write"},
+                "repository_selection": "all",
+            }
+        )
         token = await client.get_access_token()
         assert token == "token"
 
     async def test_get_access_token_failure(self, client, session, response):
         response.status = 401
-        response.json.return_value = {"error": "error"}
+        response.text.return_value = '{"error": "error"}'
         with pytest.raises(scm.github.APIException):
             await client.get_access_token()
 
     async def test_get_access_token_cache(self, client, session, response):
         response.status = 201
-        response.json.return_value = scm.github.GithubAccessData(
-            token="token",
-            expires_at=datetime.utcnow().replace(tzinfo=timezone.utc)
-            + timedelta(hours=1),
-            permissions={},
-            repository_selection="repository_selection",
-        ).dict()
+        response.read.return_value = orjson.dumps(
+            scm.github.GithubAccessData(
+                token="token",
+                expires_at=datetime.utcnow().replace(tzinfo=timezone.utc)
+                + timedelta(hours=1),
+            ).dict()
+        )
         token = await client.get_access_token()
         assert token == "token"
-        calls = len(session.post.mock_calls)
+        calls = len(session.request.mock_calls)
+
+        assert await client.get_access_token() == "token"
+        assert len(session.request.mock_calls) == calls
+
+    async def test_get_access_token_refresh_expiring(self, client, session, response):
+        response.status = 201
+        response.read.return_value = orjson.dumps(
+            scm.github.GithubAccessData(
+                token="token",
+                expires_at=datetime.now(timezone.utc) + timedelta(seconds=10),
+            ).dict()
+        )
+        assert await client.get_access_token() == "token"
+        calls = len(session.request.mock_calls)
 
         assert await client.get_access_token() == "token"
-        assert len(session.post.mock_calls) == calls
+        assert len(session.request.mock_calls) > calls
+
+    async def test_get_jwt_token_cache(self, client):
+        token = await client._get_jwt_token()
+        assert await client._get_jwt_token() == token
+
+    async def test_get_jwt_token_signature(self, client):
+        client.settings.github_app_id = "123"
+        token = await client._get_jwt_token()
+        data = jwt.decode(token, client._private_key.public_key(), algorithms=["RS256"])
+        assert data["iss"] == "123"
+
+    async def test_get_jwt_token_refresh_expiring(self, client):
+        scm.github._token_cache[client.installation_id] = scm.github.Token(
+            jwt_token="expiring", jwt_expiration=asyncio.get_running_loop().time() + 5
+        )
+        assert await client._get_jwt_token() != "expiring"
 
     async def test_get_pulls_missing(self, client, session, response, token):
         response.status = 422
         pulls = await client.get_pulls("org", "repo", "commit_hash")
         assert len(pulls) == 0
 
+    async def test_get_pulls(self, client, session, response, token):
+        response.read.return_value = orjson.dumps(
+            [{"number": 1, "base": {"ref": "master"}, "head": {"ref": "feature"}}]
+        )
+        pulls = await client.get_pulls("org", "repo", "commit_hash")
+        assert pulls == [scm.github.Pull(id=1, base="master", head="feature")]
+        kwargs = session.request.call_args.kwargs
+        assert kwargs["params"] is None
+        assert kwargs["data"] is None
+        assert "Content-Type" not in kwargs["headers"]
+
+    async def test_get_pulls_cache(self, client, session, response, token):
+        response.read.return_value = orjson.dumps(
+            [{"number": 1, "base": {"ref": "master"}, "head": {"ref": "feature"}}]
+        )
+        results = await asyncio.gather(
+            client.get_pulls("org", "repo", "commit_hash"),
+            client.get_pulls("org", "repo", "commit_hash"),
+        )
+        assert results[0] == results[1]
+        assert await client.get_pulls("org", "repo", "commit_hash") == results[0]
+        assert session.request.call_count == 1
+
     async def test_get_pulls_auth_error(self, client, session, response, token):
         response.status = 401
         with pytest.raises(scm.github.AuthorizationException):
             await client.get_pulls("org", "repo", "commit_hash")
 
+    async def test_get_pulls_error(self, client, session, response, token):
+        response.status = 500
+        with pytest.raises(scm.github.APIException) as exc_info:
+            await client.get_pulls("org", "repo", "commit_hash")
+        assert not isinstance(exc_info.value, scm.github.AuthorizationException)
+
+    async def test_get_pull_diff(self, client, session, chunks, token):
+        # multi-byte character split across chunks
+        chunks[:] = [
+            "+ caf\u00e9".encode("utf-8")[:-1],
+            "\u00e9".encode("utf-8")[-1:] + b"\n",
+        ]
+        assert await client.get_pull_diff("org", "repo", "id") == "+ caf\u00e9\n"
+
     async def test_get_pull_diff_auth_error(self, client, session, response, token):
         response.status = 401
         with pytest.raises(scm.github.AuthorizationException):
@@ -128,14 +220,14 @@ class TestGithub:
 
     async def test_create_check(self, client, session, response, token):
         response.status = 201
-        check = scm.github.GithubCheck(
-            id=123,
-            status="created",
-            started_at=datetime.utcnow(),
-            name="name",
-            head_sha="head_sha",
+        response.read.return_value = orjson.dumps(
+            {
+                "id": 123,
+                "status": "created",
+                "name": "name",
+                "head_sha": "head_sha",
+            }
         )
-        response.json.return_value = check.dict()
         assert await client.create_check("org", "repo", "commit") == "123"
 
     async def test_create_check_auth_error(self, client, session, response, token):
@@ -145,14 +237,14 @@ class TestGithub:
 
     async def test_update_check(self, client, session, response, token):
         await client.update_check("org", "repo", "check_id")
-        assert session.patch.mock_calls[0].kwargs["json"] == {
+        assert orjson.loads(session.request.mock_calls[0].kwargs["data"]) == {
             "status": "completed",
             "conclusion": "failure",
         }
 
     async def test_update_check_success(self, client, session, response, token):
         await client.update_check("org", "repo", "check_id", running=True, success=True)
-        assert session.patch.mock_calls[0].kwargs["json"] == {
+        assert orjson.loads(session.request.mock_calls[0].kwargs["data"]) == {
             "status": "in_progress",
             "conclusion": "success",
         }
@@ -164,8 +256,7 @@ class TestGithub:
 
     async def test_create_comment(self, client, session, response, token):
         response.status = 201
-        comment = scm.github.GithubComment(id=123, body="text")
-        response.json.return_value = comment.dict()
+        response.read.return_value = orjson.dumps({"id": 123, "body": "text"})
         assert await client.create_comment("org", "repo", "pull_id", "text") == "123"
 
     async def test_create_comment_auth_error(self, client, session, response, token):
@@ -182,6 +273,41 @@ class TestGithub:
         with pytest.raises(scm.github.APIException):
             await client.update_comment("org", "repo", "123", "text")
 
+    async def test_download_file(self, client, session, chunks, token):
+        data = [
+            chunk
+            async for chunk in client.download_file("org", "repo", "commit", "filename")
+        ]
+        assert b"".join(data) == b"foobar"
+
+    async def test_download_files(self, client, session, chunks, token):
+        files = [
+            (filename, b"".join([chunk async for chunk in stream]))
+            async for filename, stream in client.download_files(
+                "org", "repo", "commit", ["one", "two", "one"], concurrency=1
+            )
+        ]
+        assert files == [("one", b"foobar"), ("two", b"foobar"), ("one", b"foobar")]
+
+    async def test_download_files_skip_stream(self, client, session, chunks, token):
+        # unread streams are dropped so they do not hold up the others
+        filenames = [
+            filename
+            async for filename, _ in client.download_files(
+                "org", "repo", "commit", ["one", "two"], concurrency=1
+            )
+        ]
+        assert filenames == ["one", "two"]
+
+    async def test_download_files_error(self, client, session, response, token):
+        response.status = 404
+        async for filename, stream in client.download_files(
+            "org", "repo", "commit", ["one"]
+        ):
+            with pytest.raises(scm.github.NotFoundException):
+                async for chunk in stream:
+                    ...
+
     async def test_download_file_401(self, client, session, response, token):
         response.status = 401
         with pytest.raises(scm.github.AuthorizationException):
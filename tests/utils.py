@@ -23,3 +23,8 @@ async def add_coverage(
         commit=commit,
     )
     await reporter(coverage_data=read_data(coverage_filename))
+
+
+async def async_iter(items):
+    for item in items:
+        yield item